@@ -1,11 +1,12 @@
 import os
+import sys
 import subprocess
-from mobsftester import *
 import time
-import xmltodict
 import json
-import matplotlib.pyplot as plt
-import numpy as np
+import shlex
+import argparse
+import statistics
+import traceback
 
 # pylint: disable=pointless-string-statement
 """
@@ -20,8 +21,36 @@ import numpy as np
         - parsing outputs for all of the aformentioned tools
         - creating a visual representation of the distribution of running times for each tool
         - creating a visual representation of possible correlations between number of findings and apk / dex sizes.
+
+    Heavy dependencies (matplotlib, numpy, xmltodict and the mobsf REST client) are imported inside the
+    functions that need them, so that every subcommand only pays for what it actually uses.
 '"""
 
+TOOLS = ["apkid", "apkleaks", "mobsf", "flowdroid"]
+
+# flowdroid configurations, from the most precise to the cheapest; a job that times out or runs out of memory on a rung
+# is retried on the next one. The options are appended to the flowdroid command line, see `--help` of soot-infoflow-cmd.
+DEFAULT_FLOWDROID_LADDER = [
+    # the original, full configuration
+    {"name": "default", "options": "", "timeout": 150},
+    # no source to sink path reconstruction, shorter access paths
+    {"name": "no-paths", "options": "-pr NONE -al 3", "timeout": 150},
+    # cheaper call graph, no static field tracking
+    {"name": "cha", "options": "-cg CHA -pr NONE -al 1 -ns", "timeout": 150},
+    # per phase timeouts, so that flowdroid stops by itself and writes whatever it found
+    {"name": "phase-timeouts", "options": "-cg CHA -pr NONE -al 1 -ns -ct 30 -dt 60 -rt 20", "timeout": 150},
+]
+
+# the ladder used by this process, may be replaced through --ladder
+flowdroid_ladder = DEFAULT_FLOWDROID_LADDER
+
+# every process keeps its own sketch file within this folder, they are merged when read
+SKETCHES_FOLDER = "sketches"
+
+# the sketches updated by this process and the file they are saved to, created on first use
+process_sketches = None
+process_sketches_file = None
+
 def run_apkid(_name):
     """
     Runs apkid on the apk file.
@@ -46,6 +75,8 @@ def run_apkid(_name):
         
         end_time = "{:.2f}".format(float(time.time() - start_time))
 
+        record_sketch("runtime_apkid", float(end_time))
+
         # write the amount of time it took to run apkid
         with open("runtimes/runtime_apkid.txt", "a") as runtime_file:
             runtime_file.write(f"{_name}: {end_time}\n")
@@ -84,6 +115,8 @@ def run_apkleaks(_name):
 
         end_time = "{:.2f}".format(float(time.time() - start_time))
         
+        record_sketch("runtime_apkleaks", float(end_time))
+
         # write the amount of time it took to run apkleaks
         with open("runtimes/runtime_apkleaks.txt", "a") as runtime_file:
             runtime_file.write(f"{_name}: {end_time}\n")
@@ -100,13 +133,19 @@ def run_apkleaks(_name):
 
 def run_flowdroid(_name):
     """
-    Runs flowdroid on the apk file.
-        
+    Runs flowdroid on the apk file, climbing down the flowdroid ladder whenever a configuration times out or runs out of memory.
+
+    Every attempt is written to runtimes/flowdroid_ladder.txt as `app_name: rung: outcome: runtime`, where the outcome is
+    one of ok, timeout, oom or error. The result of an earlier run is moved to flowdroid_output/{app_name}_flowdroid.previous.xml
+    first. The stdout and stderr of all attempts are kept in flowdroid_output/{app_name}_flowdroid.log,
+    and the rung that produced the result in flowdroid_output/{app_name}_flowdroid.rung, next to the xml.
+
     Args:
         _name (str): The name of the apk file
 
     Returns:
-        - May return either the xml result of running flowdroid or add a new line to the timeouts.txt file, should the tool timeout while running.
+        - May return either the xml result of running flowdroid or add a new line to the timeouts.txt file, should every rung of the ladder timeout while running.
+        - The name of the rung that produced the result, or None.
     """
     print(f"Running flowdroid on {_name}")
 
@@ -114,31 +153,83 @@ def run_flowdroid(_name):
     # also the SDK from the command
     flow_droid_folder = "/Users/vlad/Desktop/THESIS/FlowDroid-2.10"
 
-    start_time = time.time()
+    xml_path = f"flowdroid_output/{_name[:-4]}_flowdroid.xml"
+    log_path = f"flowdroid_output/{_name[:-4]}_flowdroid.log"
+    rung_path = f"flowdroid_output/{_name[:-4]}_flowdroid.rung"
+
+    # flowdroid command construction, as a list so that the apk name is passed as is, whatever characters it contains;
+    # the jvm exits on OutOfMemoryError instead of limping on, so that it can be detected
+    flowdroid_cmd = [
+        "java", "-XX:+ExitOnOutOfMemoryError",
+        "-jar", f"{flow_droid_folder}/soot-infoflow-cmd/target/soot-infoflow-cmd-jar-with-dependencies.jar",
+        "-s", f"{flow_droid_folder}/soot-infoflow-android/SourcesAndSinks.txt",
+        "-a", f"apps/{_name}",
+        "-p", "/Users/vlad/Library/Android/sdk/platforms",
+        "-o", xml_path,
+    ]
+
+    # the result and rung of an earlier run must not be attributed to this one, should every rung fail now
+    if os.path.exists(xml_path):
+        os.replace(xml_path, f"flowdroid_output/{_name[:-4]}_flowdroid.previous.xml")
+    if os.path.exists(rung_path):
+        os.remove(rung_path)
+
+    with open(log_path, "w") as log_file:
+        for rung in flowdroid_ladder:
+            log_file.write(f"=== {rung['name']} ===\n")
+            log_file.flush()
+
+            # only this attempt's part of the log is checked for an OutOfMemoryError
+            log_start = os.path.getsize(log_path)
+            start_time = time.time()
+
+            try:
+                # Run flowdroid; without a shell, so that the timeout kills java itself rather than just the shell
+                completed = subprocess.run(flowdroid_cmd + shlex.split(rung["options"]), timeout = rung["timeout"], stdout = log_file, stderr = log_file)
+
+                if completed.returncode == 0:
+                    outcome = "ok"
+                else:
+                    with open(log_path, "r") as f:
+                        f.seek(log_start)
+                        outcome = "oom" if "java.lang.OutOfMemoryError" in f.read() else "error"
 
-    # flowdroid command construction
-    flowdroid_cmd = f"java -jar {flow_droid_folder}/soot-infoflow-cmd/target/soot-infoflow-cmd-jar-with-dependencies.jar -s {flow_droid_folder}/soot-infoflow-android/SourcesAndSinks.txt -a apps/{_name} -p /Users/vlad/Library/Android/sdk/platforms -o flowdroid_output/{_name[:-4]}_flowdroid.xml"
+            # this rung timed out -> try the next, cheaper one
+            except subprocess.TimeoutExpired:
+                outcome = "timeout"
 
-    try:
-        # Run flowdroid
-        subprocess.run(flowdroid_cmd, shell = True, timeout = 150, check = True)
+            end_time = "{:.2f}".format(float(time.time() - start_time))
 
-        end_time = "{:.2f}".format(float(time.time() - start_time))
+            # write which rung was tried, and how it went
+            with open("runtimes/flowdroid_ladder.txt", "a") as ladder_file:
+                ladder_file.write(f"{_name}: {rung['name']}: {outcome}: {end_time}\n")
 
-        # write the amount of time it took to run flowdroid
-        with open("runtimes/runtime_flowdroid.txt", "a") as runtime_file:
-            runtime_file.write(f"{_name}: {end_time}\n")
+            if outcome == "ok":
 
-    # flowdroid timed out -> add it to the timeouts.txt file
-    except subprocess.TimeoutExpired:
-        
-        # Add a new line to the timeouts.txt file
-        with open("flowdroid_timeouts.txt", "a") as f:
-            f.write(f"flowdroid: {_name}\n")
+                record_sketch("runtime_flowdroid", float(end_time))
 
-        print("TIMEOUT + flowdroid timed out + TIMEOUT on the following app: " + _name)
-        return
-    
+                # write the amount of time it took to run the rung that produced the result
+                with open("runtimes/runtime_flowdroid.txt", "a") as runtime_file:
+                    runtime_file.write(f"{_name}: {end_time}\n")
+
+                # write which rung produced the result, as cheaper rungs are less precise
+                with open(rung_path, "w") as f:
+                    f.write(f"{rung['name']}\n")
+
+                return rung["name"]
+
+            # a cheaper configuration does not help against a crash, only against running out of time or memory
+            if outcome == "error":
+                print(f"ERROR + flowdroid failed on rung {rung['name']} + ERROR on the following app: " + _name)
+                return
+
+            print(f"{outcome.upper()} + flowdroid rung {rung['name']} + {outcome.upper()} on the following app: " + _name)
+
+    # every rung timed out -> add it to the timeouts.txt file
+    with open("flowdroid_timeouts.txt", "a") as f:
+        f.write(f"flowdroid: {_name}\n")
+
+    print("TIMEOUT + flowdroid timed out + TIMEOUT on the following app: " + _name)
 
 def run_mobsf(_name):
     """
@@ -150,6 +241,9 @@ def run_mobsf(_name):
     Returns:
         - The raw output of mobsf in json format.
     """
+    # the mobsf client pulls in requests and requests_toolbelt, so only import it when mobsf actually runs
+    from mobsftester import upload, scan, json_resp
+
     start_time = time.time()
 
     # upload file to mobsf server
@@ -166,10 +260,86 @@ def run_mobsf(_name):
 
     end_time = "{:.2f}".format(float(time.time() - start_time))
 
+    record_sketch("runtime_mobsf", float(end_time))
+
     # write the amount of time it took to run mobsf
     with open("runtimes/runtime_mobsf.txt", "a") as runtime_file:
         runtime_file.write(f"{_name}: {end_time}\n")
 
+def record_sketch(_sketch, _value):
+    """
+    Adds a value to one of the quantile sketches of this process, and persists them.
+
+    Runtimes must be recorded before they are appended to their runtime file, so that the first use backfill
+    does not count them twice.
+
+    Args:
+        _sketch (str): The name of the sketch, eg. runtime_apkid, size_apk or findings_mobsf
+        _value (float): The value to add.
+    """
+    global process_sketches, process_sketches_file
+
+    import uuid
+    from sketches import TDigest, save_sketches
+
+    if process_sketches is None:
+        backfill_runtime_sketches()
+
+        # pids get reused (eg. in containers), so the file name needs to be unique on its own
+        process_sketches = {}
+        process_sketches_file = f"{SKETCHES_FOLDER}/{os.uname().nodename}_{os.getpid()}_{uuid.uuid4().hex}.json"
+
+    process_sketches.setdefault(_sketch, TDigest()).update(_value)
+
+    save_sketches(process_sketches_file, process_sketches)
+
+def record_apk_sketch(_sketch, _name, _value):
+    """
+    Adds a per apk value (eg. its size or number of findings) to a sketch, unless it was already recorded for this
+    apk; re-running the tools on an apk would otherwise count it twice.
+
+    Args:
+        _sketch (str): The name of the sketch, eg. size_apk or findings_mobsf
+        _name (str): The name of the apk file.
+        _value (float): The value to add.
+    """
+    recorded_folder = f"{SKETCHES_FOLDER}/recorded/{_sketch}"
+
+    if not os.path.exists(recorded_folder):
+        os.makedirs(recorded_folder, exist_ok = True)
+
+    # creating the marker file is atomic, so only one process gets to record the apk
+    try:
+        os.close(os.open(f"{recorded_folder}/{_name}", os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return
+
+    record_sketch(_sketch, _value)
+
+def backfill_runtime_sketches():
+    """
+    Builds the runtime sketches from the runtime files, once, so that the sketches always cover the runs that were
+    made before they were kept. Does nothing if the backfill was already done.
+    """
+    from sketches import TDigest, save_sketches
+
+    backfill_file = f"{SKETCHES_FOLDER}/runtimes.json"
+
+    if os.path.exists(backfill_file):
+        return
+
+    if not os.path.exists(SKETCHES_FOLDER):
+        os.makedirs(SKETCHES_FOLDER, exist_ok = True)
+
+    sketches = {}
+
+    for tool in TOOLS:
+        if os.path.exists(f"runtimes/runtime_{tool}.txt"):
+            for running_time in read_running_times(f"runtime_{tool}.txt"):
+                sketches.setdefault(f"runtime_{tool}", TDigest()).update(running_time)
+
+    save_sketches(backfill_file, sketches)
+
 def create_output_folders():
     """
     Creates the output folders.
@@ -276,6 +446,7 @@ def parse_flowdroid_output(_output):
     Returns:
         - The parsed output of flowdroid in json format.
     """
+    import xmltodict
 
     # we try to use the xmltodict library;
     try:
@@ -291,6 +462,22 @@ def parse_flowdroid_output(_output):
     except FileNotFoundError:
         pass
 
+def get_flowdroid_rung(_output):
+    """
+    Returns the flowdroid ladder rung that produced the flowdroid output.
+
+    Args:
+        _output (str): The name of the apk file
+
+    Returns:
+        - The name of the rung, or None if flowdroid has no result for the apk (or ran before the ladder existed).
+    """
+    try:
+        with open("flowdroid_output/" + _output[:-4] + "_flowdroid.rung", "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
 def parse_mobsf_output(_output):
     """
     Parses the output of mobsf.
@@ -379,42 +566,85 @@ def get_dex_size(_name):
 
     return float("{:.2f}".format(total_mb))
 
+def read_running_times(_tool_runtime):
+    """
+    Reads the running times of a tool.
+
+    Args:
+        _tool_runtime (str): The runtime file of a tool, eg. runtime_apkid.txt
+
+    Returns:
+        - A list with every running time in the file, in seconds; an app that was run several times counts every time.
+    """
+    running_times = []
+
+    with open(f"runtimes/{_tool_runtime}", "r") as f:
+
+        # the structure of the file looks like this:
+        # app_name: runtime ; thus we only need what comes after the last `:`
+        for line in f:
+            if ":" in line:
+                running_times.append(float(line.rsplit(":", 1)[1].strip()))
+
+    return running_times
+
+def iqr_bounds(_values):
+    """
+    Computes the outlier bounds of a list of values, based on the quartile method.
+
+    The quartiles are interpolated linearly, same as numpy's default percentile, so that this does not need
+    to import numpy.
+
+    Args:
+        _values (list): The values to compute the bounds for.
+
+    Returns:
+        - A (lower_bound, upper_bound) tuple; values strictly within the bounds are not outliers.
+    """
+    if len(_values) < 2:
+        return (float("-inf"), float("inf"))
+
+    q1, _, q3 = statistics.quantiles(_values, n = 4, method = "inclusive")
+    iqr = q3 - q1
+
+    return (q1 - (1.5 * iqr), q3 + (1.5 * iqr))
+
 def distribution_running_times(_tool_runtime):
     """
     Plots the distribution of running times for an app using the matplotlib library.
 
     Args:
-        _tool_runtime (dict): The running times of a tool.
+        _tool_runtime (str): The runtime file of a tool, eg. runtime_apkid.txt
 
     Returns:
         - The distribution of running times for an app as a png histogram.
     """
-    with open(f"runtimes/{_tool_runtime}", "r") as f:
-        running_times = f.readlines()
+    import matplotlib.pyplot as plt
+    import numpy as np
+    from sketches import load_sketches
 
-    # the structure of the file looks like this:
-    # app_name: runtime ; thus we only need the runtime
-    running_times = [float(x.split(":")[1].strip()) for x in running_times]
+    # the sketch is kept up to date as the tools run, and backfilled from the runtime file the first time
+    backfill_runtime_sketches()
+    sketch = load_sketches(SKETCHES_FOLDER).get(_tool_runtime[:-4])
 
-    running_times.sort()
+    if sketch is None:
+        print(f"No running times in runtimes/{_tool_runtime}")
+        return
 
     # exclude the outliers, calculated based on the quartile method
-    q1 = np.percentile(running_times, 25)
-    q3 = np.percentile(running_times, 75)
-    iqr = q3 - q1
-    lower_bound = q1 - (1.5 * iqr)
-    upper_bound = q3 + (1.5 * iqr)
+    lower_bound, upper_bound = sketch.iqr_bounds()
+
+    # the histogram only covers the running times within the bounds
+    lower = max(lower_bound, sketch.min)
+    upper = min(upper_bound, sketch.max)
+    counts, edges = sketch.histogram(20, lower, upper)
 
-    # remove the outliers
-    running_times = [x for x in running_times if lower_bound < x < upper_bound]
-        
     # plot the distribution of running times for an app
-    plt.hist(running_times, bins = 20, color = 'green', edgecolor = 'black')
+    plt.bar(edges[:-1], counts, width = np.diff(edges), align = 'edge', color = 'green', edgecolor = 'black')
     plt.title("Distribution of Running Times for " + _tool_runtime.split("_")[1][:-4])
     plt.xlabel("Running Time (seconds)")
     plt.ylabel("Frequency")
-    print(max(running_times))
-    plt.xticks(np.arange(min(running_times), max(running_times), 10))
+    plt.xticks(np.arange(lower, upper, 10))
     plt.savefig(f'statistics/distribution_runtimes_{_tool_runtime.split("_")[1][:-4]}.png')
 
 def number_of_findings(_output, _tool):
@@ -496,6 +726,7 @@ def correlation_size_nrfindings(_apk_files, _tool, _option):
     Returns:
         The correlation of the number of findings to the size of the apk or dex files, as a png scatter plot.
     """
+    import matplotlib.pyplot as plt
 
     if _option == "apk":
         # get the size of apks
@@ -510,12 +741,19 @@ def correlation_size_nrfindings(_apk_files, _tool, _option):
     # sort the size_dict based on the value and store it in a size array
     sorted_size_dict = sorted(size_dict.items(), key=lambda x: x[1])
 
-    # exclude the outliers using the quartile method
-    q1 = np.percentile([float(x[1]) for x in sorted_size_dict], 25)
-    q3 = np.percentile([float(x[1]) for x in sorted_size_dict], 75)
-    iqr = q3 - q1
-    lower_bound = q1 - (1.5 * iqr)
-    upper_bound = q3 + (1.5 * iqr)
+    # the dex sizes are only computed here (they need the apks to be unpacked), so this is where they are recorded
+    for name, size in size_dict.items():
+        record_apk_sketch(f"size_{_option}", name, size)
+
+    # exclude the outliers using the quartile method; the size sketch already holds the quartiles
+    from sketches import load_sketches
+
+    sketch = load_sketches(SKETCHES_FOLDER).get(f"size_{_option}")
+
+    if sketch is not None:
+        lower_bound, upper_bound = sketch.iqr_bounds()
+    else:
+        lower_bound, upper_bound = iqr_bounds([float(x[1]) for x in sorted_size_dict])
 
     # remove the outliers
     sorted_size_dict = [x for x in sorted_size_dict if lower_bound < float(x[1]) < upper_bound]
@@ -536,21 +774,24 @@ def correlation_size_nrfindings(_apk_files, _tool, _option):
     # pearson_corr = np.corrcoef(size_array, nr_findings)
     # print("Pearson correlation coefficient: ", pearson_corr)
 
-def summarise_results():
+def summarise_apk(_apk_name, _tools = TOOLS):
     """
-    Summarises the results, aggregating the highest severity findings of all results.
+    Selects the highest severity findings of a single apk, from the outputs of the tools.
+
+    Tools without an output for the apk (not run, timed out or failed) are skipped.
+
+    Args:
+        _apk_name (str): The name of the apk file.
+        _tools (list): The tools to summarise the outputs of.
 
     Returns:
-        A dictionary containing the highest severity findings of all results.
+        A dictionary containing the highest severity findings of the apk, per tool.
     """
-    # get the highest severity findings of all results
     highest_severity_findings = {"apkid": [], "mobsf": [], "apkleaks": [], "flowdroid": []}
-    apk_files = [f for f in os.listdir("apps/") if f.endswith(".apk")]
 
-    for apk_name in apk_files:
-        
+    if "apkid" in _tools and os.path.exists(output_file(_apk_name, "apkid")):
         # select highest severity findings of the parsed apkid results
-        apkid_parsed = parse_apkid_output(apk_name)
+        apkid_parsed = parse_apkid_output(_apk_name)
 
         for key, value in apkid_parsed.items():
 
@@ -560,11 +801,12 @@ def summarise_results():
             for suspicious_string in suspicious:
                 if suspicious_string in value:
                     highest_severity_findings["apkid"].append(
-                        (apk_name, key) # add the key instead, for cleaner summary; up to the reasearcher to look into the specific output file
+                        (_apk_name, key) # add the key instead, for cleaner summary; up to the reasearcher to look into the specific output file
                     )
 
+    if "apkleaks" in _tools and os.path.exists(output_file(_apk_name, "apkleaks")):
         # select highest severity findings of the parsed apkleaks results
-        apkleaks_parsed = parse_apkleaks_output(apk_name)
+        apkleaks_parsed = parse_apkleaks_output(_apk_name)
 
         for key, value in apkleaks_parsed.items():
 
@@ -575,11 +817,12 @@ def summarise_results():
             for suspicious_string in suspicious:
                 if suspicious_string in key:
                     highest_severity_findings["apkleaks"].append(
-                        (apk_name, key) # add the key instead, for cleaner summary; up to the reasearcher to look into the specific output file
+                        (_apk_name, key) # add the key instead, for cleaner summary; up to the reasearcher to look into the specific output file
                     )
 
+    if "flowdroid" in _tools and os.path.exists(output_file(_apk_name, "flowdroid")):
         # select highest severity findings of the parsed flowdroid results
-        flowdroid_parsed = parse_flowdroid_output(apk_name)
+        flowdroid_parsed = parse_flowdroid_output(_apk_name)
         # print(flowdroid_parsed)
 
         if flowdroid_parsed:
@@ -587,88 +830,524 @@ def summarise_results():
             # print(flowdroid_parsed.keys())
             if "Results" in flowdroid_parsed['DataFlowResults']:
                 highest_severity_findings["flowdroid"].append(
-                    (apk_name, len(flowdroid_parsed['DataFlowResults']['Results']['Result'])) # append nr of results
+                    (_apk_name, len(flowdroid_parsed['DataFlowResults']['Results']['Result']), get_flowdroid_rung(_apk_name)) # append nr of results, and the rung that found them
                 )
 
+    if "mobsf" in _tools and os.path.exists(output_file(_apk_name, "mobsf")):
         # select highest severity findings of the parsed mobsf results
-        mobsf_parsed = parse_mobsf_output(apk_name)
-        
+        mobsf_parsed = parse_mobsf_output(_apk_name)
+
         if mobsf_parsed["trackers"]["detected_trackers"]:
-            highest_severity_findings["mobsf"].append((apk_name, "trackers"))
- 
+            highest_severity_findings["mobsf"].append((_apk_name, "trackers"))
+
         if mobsf_parsed["secrets"]:
-            highest_severity_findings["mobsf"].append((apk_name, "secrets"))
+            highest_severity_findings["mobsf"].append((_apk_name, "secrets"))
 
         if mobsf_parsed["appsec"]["high"]:
-            highest_severity_findings["mobsf"].append((apk_name, "appsec"))
-    
-    # sort the array based on nr of findings (apk_name, nr_findings)
+            highest_severity_findings["mobsf"].append((_apk_name, "appsec"))
+
+    return highest_severity_findings
+
+def merge_summaries(_summaries):
+    """
+    Merges the summaries of single apks, as returned by summarise_apk, into the summary of all of them.
+
+    Args:
+        _summaries (iterable): The summaries of single apks.
+
+    Returns:
+        A dictionary containing the highest severity findings of all the apks.
+    """
+    highest_severity_findings = {"apkid": [], "mobsf": [], "apkleaks": [], "flowdroid": []}
+
+    for summary in _summaries:
+        for tool, findings in summary.items():
+            highest_severity_findings[tool].extend(findings)
+
+    # sort the array based on nr of findings (apk_name, nr_findings, rung)
     highest_severity_findings["flowdroid"] = sorted(highest_severity_findings["flowdroid"], key=lambda x: x[1], reverse=True)
 
     return highest_severity_findings
 
-def run_tools(_apk_files):
+def summarise_results():
+    """
+    Summarises the results, aggregating the highest severity findings of all results.
+
+    Returns:
+        A dictionary containing the highest severity findings of all results.
+    """
+    # get the highest severity findings of all results
+    return merge_summaries(summarise_apk(apk_name) for apk_name in list_apk_files())
+
+def run_tools(_apk_files, _tools = TOOLS):
     """
     Run the tools on all the apk files.
 
+    Args:
+        _apk_files (list): The names of the apk files.
+        _tools (list): The tools to run, in order; defaults to all of them.
+
     Returns:
         - Raw outputs from all of the tools organized by their subsequent output folders.
+        - A dictionary with the number of findings of every apk, per tool.
     """
-    for apk in apk_files:
+    nr_findings = {}
 
-        # Run apkid
-        run_apkid(apk)
+    for apk in _apk_files:
+        for tool in _tools:
+            RUNNERS[tool](apk)
 
-        # Run apkleaks
-        run_apkleaks(apk)
+        nr_findings[apk] = count_findings(apk, _tools)
 
-        # Run mobsf
-        run_mobsf(apk)
+        # keep the size and findings sketches up to date, now that this apk is done; the dex size is left out, as it
+        # needs the apk to be unpacked, and is recorded by correlation_size_nrfindings instead
+        record_apk_sketch("size_apk", apk, get_apk_size(apk))
 
-        # Run flowdroid
-        run_flowdroid(apk)
+        for tool, count in nr_findings[apk].items():
+            if count is not None:
+                record_apk_sketch(f"findings_{tool}", apk, count)
 
-if __name__ == "__main__":
+    return nr_findings
+
+def output_file(_name, _tool):
+    """
+    Returns the path of the output file of a tool for an apk.
+
+    Args:
+        _name (str): The name of the apk file.
+        _tool (str): The tool.
 
-    # List all the apk files form current working directory.
-    apk_files = [f for f in os.listdir("apps/") if f.endswith(".apk")]
+    Returns:
+        - The path of the output file, eg. apkid_output/app_apkid.txt
+    """
+    extensions = {"apkid": "txt", "apkleaks": "txt", "mobsf": "json", "flowdroid": "xml"}
+
+    return f"{_tool}_output/{_name[:-4]}_{_tool}.{extensions[_tool]}"
+
+def count_findings(_name, _tools = TOOLS):
+    """
+    Counts the findings of every tool for an apk, tolerating missing outputs.
+
+    Args:
+        _name (str): The name of the apk file.
+        _tools (list): The tools to count the findings of.
+
+    Returns:
+        - A dictionary with the number of findings per tool, None for the tools that have no (complete) output.
+    """
+    nr_findings = {}
+
+    for tool in _tools:
+
+        # the parsers of apkleaks and flowdroid return empty results for a missing output, which would count as 0
+        if not os.path.exists(output_file(_name, tool)):
+            nr_findings[tool] = None
+            continue
+
+        try:
+            nr_findings[tool] = number_of_findings(_name, tool)
+        except (FileNotFoundError, KeyError, TypeError):
+            # the tool failed, so there is no complete output to count
+            nr_findings[tool] = None
+
+    return nr_findings
+
+def rebuild_sketches():
+    """
+    Rebuilds all the sketches from the runtime files and the outputs of the apks in apps/, replacing the
+    existing sketches. Unpacks every apk, to get its dex size.
+    """
+    import shutil
+
+    global process_sketches
+
+    if os.path.exists(SKETCHES_FOLDER):
+        shutil.rmtree(SKETCHES_FOLDER)
+
+    process_sketches = None
+
+    # the runtimes come from the runtime files, through the same backfill as on first use
+    backfill_runtime_sketches()
+
+    for apk in list_apk_files():
+        record_apk_sketch("size_apk", apk, get_apk_size(apk))
+        record_apk_sketch("size_dex", apk, get_dex_size(apk))
+
+        for tool, count in count_findings(apk).items():
+            if count is not None:
+                record_apk_sketch(f"findings_{tool}", apk, count)
+
+def list_apk_files():
+    """
+    Lists all the apk files within the apps/ folder.
+
+    Returns:
+        - A list with the names of the apk files.
+    """
+    return [f for f in os.listdir("apps/") if f.endswith(".apk")]
+
+RUNNERS = {
+    "apkid": run_apkid,
+    "apkleaks": run_apkleaks,
+    "mobsf": run_mobsf,
+    "flowdroid": run_flowdroid,
+}
+
+PARSERS = {
+    "apkid": parse_apkid_output,
+    "apkleaks": parse_apkleaks_output,
+    "mobsf": parse_mobsf_output,
+    "flowdroid": parse_flowdroid_output,
+}
+
+def load_flowdroid_ladder(_path):
+    """
+    Loads a flowdroid ladder from a json file.
+
+    Args:
+        _path (str): The json file, holding a list of {"name", "options", "timeout"} rungs, from the most precise to the cheapest.
+
+    Returns:
+        - The list of rungs.
+    """
+    with open(_path, "r") as f:
+        ladder = json.load(f)
 
-    final_res = {}
+    if not isinstance(ladder, list) or not ladder:
+        raise ValueError(f"Invalid flowdroid ladder, it needs to be a non empty list of rungs: {_path}")
+
+    for rung in ladder:
+        if not isinstance(rung, dict) or not {"name", "options", "timeout"} <= rung.keys():
+            raise ValueError(f"Invalid flowdroid rung, it needs a name, options and a timeout: {rung}")
+
+        # the name ends up in the `app_name: rung: outcome: runtime` lines of runtimes/flowdroid_ladder.txt
+        if not isinstance(rung["name"], str) or not rung["name"] or ":" in rung["name"]:
+            raise ValueError(f"Invalid flowdroid rung, its name must be a non empty string without `:`: {rung}")
+
+        if not isinstance(rung["options"], str):
+            raise ValueError(f"Invalid flowdroid rung, its options must be a string: {rung}")
+
+        if isinstance(rung["timeout"], bool) or not isinstance(rung["timeout"], (int, float)) or rung["timeout"] <= 0:
+            raise ValueError(f"Invalid flowdroid rung, its timeout must be a positive number of seconds: {rung}")
+
+    return ladder
+
+def ladder_report(_apk_files = None, _offset = 0):
+    """
+    Reports the cost and coverage of the flowdroid ladder, from runtimes/flowdroid_ladder.txt.
+
+    Args:
+        _apk_files (list): Only report on these apks; defaults to all of them.
+        _offset (int): Only report on the attempts written after this offset of the file, eg. the ones of the current batch.
+
+    Returns:
+        - A dictionary with, per rung, the number of attempts, their outcomes and their total time, and the overall coverage.
+    """
+    rungs = {}
+    covered_by = {}
+    attempted = set()
+
+    if os.path.exists("runtimes/flowdroid_ladder.txt"):
+        with open("runtimes/flowdroid_ladder.txt", "r") as f:
+            f.seek(_offset)
+
+            # the structure of the file looks like this:
+            # app_name: rung: outcome: runtime ; the app name may contain a `:` as well, so we split from the right
+            for line in f:
+                if not line.strip():
+                    continue
+
+                name, rung, outcome, runtime = [x.strip() for x in line.rsplit(":", 3)]
+
+                if _apk_files is not None and name not in _apk_files:
+                    continue
+
+                attempted.add(name)
+
+                stats = rungs.setdefault(rung, {"attempts": 0, "ok": 0, "timeout": 0, "oom": 0, "error": 0, "seconds": 0.0})
+                stats["attempts"] += 1
+                stats[outcome] += 1
+                stats["seconds"] += float(runtime)
+
+                if outcome == "ok":
+                    covered_by[name] = rung
+
+    return {
+        "rungs": rungs,
+        "apps": len(attempted),
+        "covered": len(covered_by),
+        "covered_after_first_rung": sum(1 for rung in covered_by.values() if rung != flowdroid_ladder[0]["name"]),
+        "seconds": sum(stats["seconds"] for stats in rungs.values()),
+    }
+
+def print_ladder_report(_report):
+    """
+    Prints a ladder report, as returned by ladder_report.
+    """
+    for rung, stats in _report["rungs"].items():
+        print(f"{rung}: attempts={stats['attempts']} ok={stats['ok']} timeout={stats['timeout']} "
+              f"oom={stats['oom']} error={stats['error']} seconds={stats['seconds']:.2f}")
+
+    print(f"flowdroid results for {_report['covered']}/{_report['apps']} apps "
+          f"({_report['covered_after_first_rung']} only on a cheaper rung), {_report['seconds']:.2f} seconds in total")
+
+def cmd_run(_args):
+    """
+    `run` subcommand: runs the selected tools on the given apks, or on every apk within apps/.
+    """
+    global flowdroid_ladder
+
+    apk_files = _args.apks or list_apk_files()
+    tools = _args.tool or TOOLS
+
+    if _args.ladder:
+        flowdroid_ladder = load_flowdroid_ladder(_args.ladder)
+
+    # the ladder file is append only, so this batch's attempts are the ones after its current end
+    ladder_offset = os.path.getsize("runtimes/flowdroid_ladder.txt") if os.path.exists("runtimes/flowdroid_ladder.txt") else 0
 
     start_time = time.time()
 
     # Create output folders, if they don't exist.
     create_output_folders()
-            
+
     # Run the tools.
-    # run_tools(apk_files)
+    run_tools(apk_files, tools)
 
     # Print total running time of the automation procedure.
-    # final_time = "{:.2f}".format(float(time.time() - start_time))
-    # print(f"--- {final_time} seconds --- ")
-
-    # Statistics: 
-    # NOTE Don't run all of them at the same time, the matplotlib library is not thread safe.
-    # (https://stackoverflow.com/questions/41903300/matplotlib-crashes-when-running-in-parallel)
-    # Essentially, it yields memory corrupted plots; run each function at a time.
-
-    # Correlation of the number of findings to the size of the dex files.
-    # correlation_size_nrfindings(apk_files, "apkid", "dex")
-    # correlation_size_nrfindings(apk_files, "apkleaks", "dex")
-    # correlation_size_nrfindings(apk_files, "mobsf", "dex")
-    # correlation_size_nrfindings(apk_files, "flowdroid", "dex")
-
-    # Correlation of the number of findings to the size of the apk files.
-    # correlation_size_nrfindings(apk_files, "apkid", "apk")
-    # correlation_size_nrfindings(apk_files, "apkleaks", "apk")
-    # correlation_size_nrfindings(apk_files, "mobsf", "apk")
-    # correlation_size_nrfindings(apk_files, "flowdroid", "apk")
-
-    # Distribution of the number of findings.
-    # distribution_running_times("runtime_flowdroid.txt")
-    # distribution_running_times("runtime_apkid.txt")
-    # distribution_running_times("runtime_apkleaks.txt")
-    # distribution_running_times("runtime_mobsf.txt")
-
-    # Summarise the results
-    # final_res = summarise_results()
\ No newline at end of file
+    final_time = "{:.2f}".format(float(time.time() - start_time))
+    print(f"--- {final_time} seconds --- ")
+
+    # Print the cost and coverage of the flowdroid ladder for this batch.
+    if "flowdroid" in tools:
+        print_ladder_report(ladder_report(apk_files, ladder_offset))
+
+def process_apk(_name, _tools = TOOLS):
+    """
+    Runs the tools on a single apk and collects its findings, for the watch daemon.
+
+    Args:
+        _name (str): The name of the apk file.
+        _tools (list): The tools to run.
+
+    Returns:
+        - A dictionary with the highest severity findings of the apk, its number of findings per tool and the flowdroid
+          ladder rung that produced the flowdroid results.
+    """
+    nr_findings = run_tools([_name], _tools)[_name]
+
+    return {"summary": summarise_apk(_name, _tools), "nr_findings": nr_findings, "flowdroid_rung": get_flowdroid_rung(_name)}
+
+def write_json(_path, _data):
+    """
+    Writes json data to a file atomically, so that readers never see a half written file.
+
+    Args:
+        _path (str): The path of the json file.
+        _data: The data to write.
+    """
+    with open(_path + ".tmp", "w") as f:
+        json.dump(_data, f, indent = 4)
+
+    os.replace(_path + ".tmp", _path)
+
+def watch_daemon(_tools = TOOLS, _state_file = "watch_state.json", _summary_file = "summary.json", _settle = 5.0, _poll_interval = 2.0):
+    """
+    Watches apps/ and pushes every new apk through the tools as soon as it has been fully copied.
+
+    The per apk results are kept in the state file, so that restarting the daemon does not re-check apks that were
+    already processed; the summary file is rewritten from them after every apk. Apks whose processing failed are
+    recorded with their error, and retried on the next start.
+
+    Args:
+        _tools (list): The tools to run on every apk.
+        _state_file (str): The json file holding the results of every processed apk.
+        _summary_file (str): The json file holding the summary of all the processed apks.
+        _settle (float): How long, in seconds, a new apk must stay unchanged before it is processed.
+        _poll_interval (float): How often, in seconds, apps/ is checked.
+    """
+    from watcher import watch_apks
+
+    create_output_folders()
+
+    state = {}
+    if os.path.exists(_state_file):
+        with open(_state_file, "r") as f:
+            state = json.load(f)
+
+    # the apks that failed last time are retried
+    processed = {apk for apk, result in state.items() if "error" not in result}
+
+    print(f"Watching apps/ ({len(processed)} apks already processed)")
+
+    for apk in watch_apks("apps/", processed, _settle, _poll_interval):
+        start_time = time.time()
+
+        try:
+            state[apk] = process_apk(apk, _tools)
+        except Exception:
+            # never let a single broken apk take the daemon down; it is kept in the state, so that it is not lost
+            state[apk] = {"error": traceback.format_exc()}
+            traceback.print_exc()
+            print(f"ERROR + processing failed + ERROR on the following app: {apk}")
+
+        write_json(_state_file, state)
+        write_json(_summary_file, merge_summaries(result["summary"] for result in state.values() if "summary" in result))
+
+        if "error" in state[apk]:
+            continue
+
+        final_time = "{:.2f}".format(float(time.time() - start_time))
+        print(f"--- {apk} processed in {final_time} seconds --- ")
+
+def cmd_parse(_args):
+    """
+    `parse` subcommand: prints the parsed output of a tool for the given apks, in json format.
+    """
+    parsed = {apk: PARSERS[_args.tool](apk) for apk in _args.apks}
+
+    print(json.dumps(parsed, indent = 4))
+
+def cmd_summarise(_args):
+    """
+    `summarise` subcommand: prints the highest severity findings of all results, in json format.
+    """
+    final_res = summarise_results()
+
+    if _args.output:
+        with open(_args.output, "w") as f:
+            json.dump(final_res, f, indent = 4)
+    else:
+        print(json.dumps(final_res, indent = 4))
+
+def cmd_stats(_args):
+    """
+    `stats` subcommand: prints the runtime, size and findings statistics from the sketches, without plotting anything.
+    """
+    from sketches import load_sketches
+
+    if _args.rebuild:
+        rebuild_sketches()
+
+    # the first time, the runtime sketches are built from runtimes/
+    backfill_runtime_sketches()
+    sketches = load_sketches(SKETCHES_FOLDER)
+
+    if not sketches:
+        print("No sketches yet, run the tools first")
+        return
+
+    for name, sketch in sorted(sketches.items()):
+
+        # sizes are not per tool, so they are always shown
+        if _args.tool and not name.startswith("size_") and name.split("_", 1)[1] not in _args.tool:
+            continue
+
+        lower_bound, upper_bound = sketch.iqr_bounds()
+        outliers = sketch.count * (sketch.cdf(lower_bound) + 1 - sketch.cdf(upper_bound))
+
+        print(f"{name}: n={sketch.count} min={sketch.min:.2f} q1={sketch.quantile(0.25):.2f} "
+              f"median={sketch.quantile(0.5):.2f} q3={sketch.quantile(0.75):.2f} max={sketch.max:.2f} "
+              f"bounds=({lower_bound:.2f}, {upper_bound:.2f}) outliers~{outliers:.0f}")
+
+def cmd_watch(_args):
+    """
+    `watch` subcommand: runs until interrupted, processing every apk that arrives in apps/.
+    """
+    global flowdroid_ladder
+
+    if _args.ladder:
+        flowdroid_ladder = load_flowdroid_ladder(_args.ladder)
+
+    try:
+        watch_daemon(_args.tool or TOOLS, _args.state, _args.output, _args.settle, _args.interval)
+    except KeyboardInterrupt:
+        print("Stopped watching apps/")
+
+def cmd_ladder(_args):
+    """
+    `ladder` subcommand: prints the cost and coverage of the flowdroid ladder, over all the apks or the given ones.
+    """
+    global flowdroid_ladder
+
+    if _args.ladder:
+        flowdroid_ladder = load_flowdroid_ladder(_args.ladder)
+
+    print_ladder_report(ladder_report(_args.apks or None))
+
+def cmd_plot(_args):
+    """
+    `plot` subcommand: plots either the distribution of running times or the correlation of size to findings.
+
+    NOTE Only one plot is made per invocation, the matplotlib library is not thread safe.
+    (https://stackoverflow.com/questions/41903300/matplotlib-crashes-when-running-in-parallel)
+    Essentially, it yields memory corrupted plots; run each plot at a time.
+    """
+    if _args.kind == "runtimes":
+        # Distribution of the running times.
+        distribution_running_times(f"runtime_{_args.tool}.txt")
+    else:
+        # Correlation of the number of findings to the size of the apk / dex files.
+        correlation_size_nrfindings(list_apk_files(), _args.tool, _args.kind)
+
+def build_parser():
+    """
+    Builds the command line parser, with one subparser per stage of the automation.
+
+    Returns:
+        - The argparse parser.
+    """
+    parser = argparse.ArgumentParser(description = "Runs android security tools on apps/ and analyses their outputs.")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    run_parser = subparsers.add_parser("run", help = "run the tools on the apks")
+    run_parser.add_argument("apks", nargs = "*", help = "apk names within apps/; defaults to all of them")
+    run_parser.add_argument("-t", "--tool", action = "append", choices = TOOLS, help = "tool to run; may be repeated, defaults to all")
+    run_parser.add_argument("--ladder", help = "json file with the flowdroid ladder to use instead of the default one")
+    run_parser.set_defaults(func = cmd_run)
+
+    watch_parser = subparsers.add_parser("watch", help = "keep running, processing new apks as they arrive in apps/")
+    watch_parser.add_argument("-t", "--tool", action = "append", choices = TOOLS, help = "tool to run; may be repeated, defaults to all")
+    watch_parser.add_argument("--state", default = "watch_state.json", help = "json file with the results of the processed apks")
+    watch_parser.add_argument("-o", "--output", default = "summary.json", help = "json file with the summary, updated after every apk")
+    watch_parser.add_argument("--settle", type = float, default = 5.0, help = "seconds a new apk must stay unchanged before it is processed")
+    watch_parser.add_argument("--interval", type = float, default = 2.0, help = "seconds between checks of apps/")
+    watch_parser.add_argument("--ladder", help = "json file with the flowdroid ladder to use instead of the default one")
+    watch_parser.set_defaults(func = cmd_watch)
+
+    parse_parser = subparsers.add_parser("parse", help = "print the parsed output of a tool")
+    parse_parser.add_argument("tool", choices = TOOLS)
+    parse_parser.add_argument("apks", nargs = "+", help = "apk names within apps/")
+    parse_parser.set_defaults(func = cmd_parse)
+
+    summarise_parser = subparsers.add_parser("summarise", help = "summarise the highest severity findings")
+    summarise_parser.add_argument("-o", "--output", help = "write the summary to this json file instead of stdout")
+    summarise_parser.set_defaults(func = cmd_summarise)
+
+    stats_parser = subparsers.add_parser("stats", help = "print runtime, size and findings statistics")
+    stats_parser.add_argument("-t", "--tool", action = "append", choices = TOOLS, help = "tool to report; may be repeated, defaults to all")
+    stats_parser.add_argument("--rebuild", action = "store_true", help = "rebuild the sketches from runtimes/ and the outputs first (unpacks every apk)")
+    stats_parser.set_defaults(func = cmd_stats)
+
+    ladder_parser = subparsers.add_parser("ladder", help = "print the cost and coverage of the flowdroid ladder")
+    ladder_parser.add_argument("apks", nargs = "*", help = "apk names within apps/; defaults to all of them")
+    ladder_parser.add_argument("--ladder", help = "json file with the flowdroid ladder that was used, to tell its first rung")
+    ladder_parser.set_defaults(func = cmd_ladder)
+
+    plot_parser = subparsers.add_parser("plot", help = "plot runtimes or size vs findings into statistics/")
+    plot_parser.add_argument("kind", choices = ["runtimes", "apk", "dex"], help = "runtime distribution, or correlation with apk / dex size")
+    plot_parser.add_argument("tool", choices = TOOLS)
+    plot_parser.set_defaults(func = cmd_plot)
+
+    return parser
+
+def main(_argv = None):
+    """
+    Entry point of the command line interface.
+    """
+    args = build_parser().parse_args(_argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
+
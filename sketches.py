@@ -0,0 +1,263 @@
+"""
+Streaming quantile sketches, used to keep track of running times, apk / dex sizes and number of findings
+without having to re-read the whole history every time a statistic is needed.
+
+The sketch is a merging t-digest (https://arxiv.org/abs/1902.04023): values are summarised as a bounded number of
+weighted centroids, which are small near the tails, so quartiles and outlier bounds stay accurate.
+Two digests can be merged, so each worker keeps its own sketch file and they are combined when read.
+"""
+
+import os
+import json
+import math
+import bisect
+
+
+class TDigest:
+    """
+    A mergeable streaming quantile sketch.
+
+    Up to exact_limit values, every value is kept as its own centroid, so the quantiles are exact, and interpolated
+    linearly like numpy's default percentile. Afterwards, the error is bounded in rank rather than in value, so
+    the estimate can land anywhere within a gap of the data (eg. between two clusters of running times).
+    """
+
+    def __init__(self, compression = 100, exact_limit = 5000):
+        self.compression = compression
+        self.exact_limit = exact_limit
+        self.centroids = []  # sorted [mean, weight] pairs
+        self.buffer = []     # values not yet merged into the centroids
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, _value, _weight = 1):
+        """
+        Adds a value to the sketch.
+        """
+        self.buffer.append([float(_value), _weight])
+        self.count += _weight
+        self.min = min(self.min, _value)
+        self.max = max(self.max, _value)
+
+        if len(self.buffer) >= 5 * self.compression:
+            self._compress()
+
+    def merge(self, _other):
+        """
+        Merges another sketch into this one.
+        """
+        if not _other.count:
+            return
+
+        self.buffer.extend([mean, weight] for mean, weight in _other.centroids + _other.buffer)
+        self.count += _other.count
+        self.min = min(self.min, _other.min)
+        self.max = max(self.max, _other.max)
+        self._compress()
+
+    def _k(self, _q):
+        # k1 scale function, the centroids get smaller towards q = 0 and q = 1
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(_q, 0), 1) - 1)
+
+    def _k_inverse(self, _k):
+        _k = min(max(_k, -self.compression / 4), self.compression / 4)
+        return (math.sin(_k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _compress(self):
+        """
+        Merges the buffered values into the centroids, combining neighbours as long as the scale function allows it.
+        """
+        if not self.buffer:
+            return
+
+        items = sorted(self.centroids + self.buffer)
+        self.buffer = []
+
+        # small sketches keep every value, the centroids only get combined past the exact limit
+        if self.count <= self.exact_limit:
+            self.centroids = [list(item) for item in items]
+            return
+
+        centroids = [list(items[0])]
+        weight_so_far = 0
+        q_limit = self._k_inverse(self._k(0) + 1)
+
+        for mean, weight in items[1:]:
+            current = centroids[-1]
+            q = (weight_so_far + current[1] + weight) / self.count
+
+            if q <= q_limit:
+                # merge into the current centroid, updating its mean incrementally
+                current[1] += weight
+                current[0] += (mean - current[0]) * weight / current[1]
+            else:
+                weight_so_far += current[1]
+                q_limit = self._k_inverse(self._k(weight_so_far / self.count) + 1)
+                centroids.append([mean, weight])
+
+        self.centroids = centroids
+
+    def _is_exact(self):
+        return len(self.centroids) == self.count
+
+    def _points(self):
+        """
+        The (value, cumulative weight) points the quantiles are interpolated between.
+        """
+        points = [(self.min, 0)]
+        weight_so_far = 0
+
+        for mean, weight in self.centroids:
+            points.append((mean, weight_so_far + weight / 2))
+            weight_so_far += weight
+
+        points.append((self.max, self.count))
+
+        return points
+
+    def quantile(self, _q):
+        """
+        Returns the estimated value at quantile _q, between 0 and 1.
+        """
+        self._compress()
+
+        if not self.count:
+            return math.nan
+
+        if self._is_exact():
+            values = [mean for mean, _ in self.centroids]
+            position = _q * (len(values) - 1)
+            lower = int(math.floor(position))
+            upper = min(lower + 1, len(values) - 1)
+
+            return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+        points = self._points()
+        target = _q * self.count
+
+        for (x0, c0), (x1, c1) in zip(points, points[1:]):
+            if target <= c1:
+                if c1 == c0:
+                    return x1
+                return x0 + (x1 - x0) * (target - c0) / (c1 - c0)
+
+        return self.max
+
+    def cdf(self, _value):
+        """
+        Returns the estimated fraction of values that are lower or equal to _value.
+        """
+        self._compress()
+
+        if not self.count or _value < self.min:
+            return 0.0
+
+        if _value >= self.max:
+            return 1.0
+
+        if self._is_exact():
+            return bisect.bisect_right([mean for mean, _ in self.centroids], _value) / self.count
+
+        points = self._points()
+
+        for (x0, c0), (x1, c1) in zip(points, points[1:]):
+            if _value < x1:
+                if x1 == x0:
+                    return c1 / self.count
+                return (c0 + (c1 - c0) * (_value - x0) / (x1 - x0)) / self.count
+
+        return 1.0
+
+    def iqr_bounds(self):
+        """
+        Returns the (lower_bound, upper_bound) outlier bounds, based on the quartile method.
+        """
+        if self.count < 2:
+            return (-math.inf, math.inf)
+
+        q1 = self.quantile(0.25)
+        q3 = self.quantile(0.75)
+        iqr = q3 - q1
+
+        return (q1 - (1.5 * iqr), q3 + (1.5 * iqr))
+
+    def histogram(self, _bins, _lower, _upper):
+        """
+        Returns the estimated histogram of the values between _lower and _upper.
+
+        Returns:
+            - A (counts, edges) tuple, with _bins counts and _bins + 1 edges.
+        """
+        edges = [_lower + (_upper - _lower) * i / _bins for i in range(_bins + 1)]
+        cdfs = [self.cdf(edge) for edge in edges]
+
+        # the first bin includes its lower edge, which matters when many values are equal to the minimum
+        if _lower <= self.min:
+            cdfs[0] = 0.0
+
+        counts = [(cdfs[i + 1] - cdfs[i]) * self.count for i in range(_bins)]
+
+        return (counts, edges)
+
+    def to_dict(self):
+        self._compress()
+
+        return {
+            "compression": self.compression,
+            "exact_limit": self.exact_limit,
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "centroids": self.centroids,
+        }
+
+    @classmethod
+    def from_dict(cls, _data):
+        digest = cls(_data["compression"], _data.get("exact_limit", 5000))
+        digest.count = _data["count"]
+        digest.min = _data["min"]
+        digest.max = _data["max"]
+        digest.centroids = [list(centroid) for centroid in _data["centroids"]]
+
+        return digest
+
+
+def load_sketches(_folder):
+    """
+    Loads and merges all the sketch files within a folder.
+
+    Args:
+        _folder (str): The folder holding one json sketch file per worker.
+
+    Returns:
+        - A dictionary mapping each sketch name to its merged TDigest.
+    """
+    sketches = {}
+
+    if not os.path.exists(_folder):
+        return sketches
+
+    for file in sorted(os.listdir(_folder)):
+        if not file.endswith(".json"):
+            continue
+
+        with open(os.path.join(_folder, file), "r") as f:
+            for name, data in json.load(f).items():
+                sketches.setdefault(name, TDigest(data["compression"], data.get("exact_limit", 5000))).merge(TDigest.from_dict(data))
+
+    return sketches
+
+
+def save_sketches(_path, _sketches):
+    """
+    Saves sketches to a json file, atomically.
+
+    Args:
+        _path (str): The path of the json file.
+        _sketches (dict): The sketches to save, by name.
+    """
+    with open(_path + ".tmp", "w") as f:
+        json.dump({name: digest.to_dict() for name, digest in _sketches.items()}, f)
+
+    os.replace(_path + ".tmp", _path)
@@ -0,0 +1,61 @@
+import os
+import random
+import statistics
+
+import pytest
+
+from sketches import TDigest
+
+RUNTIMES = os.path.join(os.path.dirname(__file__), "..", "runtimes")
+
+
+def read_runtimes(_file):
+    with open(os.path.join(RUNTIMES, _file), "r") as f:
+        return [float(line.rsplit(":", 1)[1]) for line in f if ":" in line]
+
+
+@pytest.mark.parametrize("runtime_file", sorted(os.listdir(RUNTIMES)))
+def test_iqr_bounds_match_exact_quartiles(runtime_file):
+    running_times = read_runtimes(runtime_file)
+
+    sketch = TDigest()
+    for running_time in running_times:
+        sketch.update(running_time)
+
+    q1, _, q3 = statistics.quantiles(running_times, n = 4, method = "inclusive")
+    iqr = q3 - q1
+
+    assert sketch.iqr_bounds() == pytest.approx((q1 - 1.5 * iqr, q3 + 1.5 * iqr))
+
+
+@pytest.mark.parametrize("runtime_file", sorted(os.listdir(RUNTIMES)))
+def test_merged_sketches_match_a_single_sketch(runtime_file):
+    running_times = read_runtimes(runtime_file)
+
+    single, first, second = TDigest(), TDigest(), TDigest()
+    for i, running_time in enumerate(running_times):
+        single.update(running_time)
+        (first if i % 2 else second).update(running_time)
+
+    first.merge(TDigest.from_dict(second.to_dict()))
+
+    assert first.count == single.count
+    assert first.iqr_bounds() == pytest.approx(single.iqr_bounds())
+
+
+def test_large_sketch_stays_bounded_and_close():
+    rng = random.Random(0)
+    values = [rng.lognormvariate(0, 1) for _ in range(50000)]
+
+    sketch = TDigest()
+    for value in values:
+        sketch.update(value)
+
+    sketch.quantile(0.5)
+    assert len(sketch.centroids) < 500
+
+    # the error is bounded in rank
+    values.sort()
+    for q in (0.25, 0.5, 0.75):
+        rank = sum(1 for value in values if value <= sketch.quantile(q)) / len(values)
+        assert rank == pytest.approx(q, abs = 0.01)
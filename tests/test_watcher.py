@@ -0,0 +1,40 @@
+import os
+import time
+import threading
+
+import pytest
+
+import watcher
+
+
+def append_slowly(_path, _chunks, _delay):
+    for _ in range(_chunks):
+        with open(_path, "ab") as f:
+            f.write(b"x" * 1000)
+        time.sleep(_delay)
+
+
+@pytest.mark.parametrize("inotify", [True, False])
+def test_apk_written_while_busy_is_not_handed_out_early(tmp_path, monkeypatch, inotify):
+    if not inotify:
+        monkeypatch.setattr(watcher, "open_inotify", lambda _folder: None)
+
+    (tmp_path / "a.apk").write_bytes(b"a" * 1000)
+    (tmp_path / "b.apk").write_bytes(b"b" * 1000)
+
+    apks = watcher.watch_apks(str(tmp_path), set(), 0.5, 0.1)
+
+    assert next(apks) == "a.apk"
+
+    # b.apk keeps being copied while a.apk is being "processed", for longer than the settle time
+    writer = threading.Thread(target = append_slowly, args = (tmp_path / "b.apk", 20, 0.1))
+    writer.start()
+    time.sleep(1.0)
+
+    assert next(apks) == "b.apk"
+    size_when_handed_out = os.path.getsize(tmp_path / "b.apk")
+
+    writer.join()
+    apks.close()
+
+    assert size_when_handed_out == os.path.getsize(tmp_path / "b.apk") == 21000
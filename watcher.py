@@ -0,0 +1,168 @@
+"""
+Watches a folder for newly arriving APK files.
+
+Linux inotify is used through ctypes when available, so new files are noticed as soon as they are written;
+on any other platform (or if inotify cannot be set up) the folder is polled instead.
+Either way, a file is only handed out once its size and modification time have stopped changing,
+so that partially copied APKs are never analysed.
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# inotify constants, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def open_inotify(_folder):
+    """
+    Sets up an inotify watch on the folder.
+
+    Args:
+        _folder (str): The folder to watch.
+
+    Returns:
+        - The inotify file descriptor, or None if inotify is not available.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+        fd = libc.inotify_init1(IN_NONBLOCK)
+    except (OSError, AttributeError):
+        return None
+
+    if fd < 0:
+        return None
+
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    if libc.inotify_add_watch(fd, os.fsencode(_folder), mask) < 0:
+        os.close(fd)
+        return None
+
+    return fd
+
+
+def read_inotify(_fd, _timeout):
+    """
+    Waits for inotify events and returns the names of the files they refer to.
+
+    Args:
+        _fd (int): The inotify file descriptor.
+        _timeout (float): How long to wait for events, in seconds.
+
+    Returns:
+        - A set with the names of the changed files, or None if events were lost and the folder should be rescanned.
+    """
+    names = set()
+
+    ready, _, _ = select.select([_fd], [], [], _timeout)
+    if not ready:
+        return names
+
+    try:
+        data = os.read(_fd, 64 * 1024)
+    except OSError as e:
+        if e.errno == errno.EAGAIN:
+            return names
+        raise
+
+    offset = 0
+    while offset < len(data):
+        _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+
+        if mask & IN_Q_OVERFLOW:
+            return None
+
+        name = data[offset:offset + length].rstrip(b"\0")
+        offset += length
+
+        if name:
+            names.add(os.fsdecode(name))
+
+    return names
+
+
+def watch_apks(_folder, _seen, _settle = 5.0, _poll_interval = 2.0):
+    """
+    Yields the names of new apk files within the folder, once they have been fully copied.
+
+    Runs forever; the files already present when watching starts are yielded as well, unless they are in _seen.
+
+    Args:
+        _folder (str): The folder to watch, eg. apps/
+        _seen (set): Names of the apk files that should not be yielded; it is updated with every yielded name.
+        _settle (float): How long, in seconds, the size and modification time of a file must stay unchanged.
+        _poll_interval (float): How often, in seconds, pending files are checked (and the folder polled, without inotify).
+    """
+    fd = open_inotify(_folder)
+
+    if fd is None:
+        print(f"inotify not available, polling {_folder} every {_poll_interval} seconds")
+
+    # name -> (size, mtime, time since which they have not changed)
+    pending = {}
+    candidates = set(os.listdir(_folder))
+
+    try:
+        while True:
+            for name in candidates:
+                if not name.endswith(".apk") or name in _seen:
+                    continue
+
+                try:
+                    stat = os.stat(os.path.join(_folder, name))
+                except FileNotFoundError:
+                    pending.pop(name, None)
+                    continue
+
+                if name not in pending or pending[name][:2] != (stat.st_size, stat.st_mtime):
+                    pending[name] = (stat.st_size, stat.st_mtime, time.time())
+
+            # hand out the files that did not change for long enough
+            for name, (size, mtime, since) in sorted(pending.items()):
+                if time.time() - since < _settle:
+                    continue
+
+                # the consumer may have been busy for a while since the scan, so check the file once more right
+                # before handing it out; if it is still being copied, it has to settle again
+                try:
+                    stat = os.stat(os.path.join(_folder, name))
+                except FileNotFoundError:
+                    del pending[name]
+                    continue
+
+                if (stat.st_size, stat.st_mtime) != (size, mtime):
+                    pending[name] = (stat.st_size, stat.st_mtime, time.time())
+                    continue
+
+                del pending[name]
+                _seen.add(name)
+                yield name
+
+            if fd is None:
+                time.sleep(_poll_interval)
+                candidates = set(os.listdir(_folder))
+            else:
+                changed = read_inotify(fd, _poll_interval)
+
+                # events were lost -> fall back to a full rescan for this round
+                if changed is None:
+                    changed = set(os.listdir(_folder))
+
+                candidates = changed | set(pending)
+    finally:
+        if fd is not None:
+            os.close(fd)